@@ -6,7 +6,6 @@ from functools import partial
 import json
 from pathlib import Path
 from threading import Thread
-import time
 
 from atom.api import (Atom, Bool, Dict, Enum, Event, Int, List, Str, observe,
                       Property, Typed, Value)
@@ -18,6 +17,7 @@ from psiaudio.stim import read_wav
 
 from .sequence import generate_nback0_sequence, generate_nback_sequence
 from .psi_controller import PSIController
+from .scheduler import TrialScheduler
 from .util import BiosemiEncoder
 
 
@@ -92,27 +92,44 @@ async def nback(n_back, config, filename, exclude_targets=None):
 
     config.experiment_info.set_current_stim(sequence[0])
     results = []
+    durations = []
+    scheduler = TrialScheduler()
+    min_iti, max_iti = 1.5, 2.5
     try:
         async with PSIController('ws://localhost:8765') as psi:
             await psi.running()
-            # Now, sleep for 1 sec to ensure that we can capture baseline
-            # before first stim.
-            time.sleep(1)
+            # Schedule the first stim 1 sec out to ensure that we can capture
+            # baseline before first stim.
+            scheduler.start(delay=1)
             for stim in sequence:
                 config.experiment_info.set_current_stim(stim)
+                wav = wav_files[stim.stim]
+                await scheduler.wait()
                 with cp.set_code(stim.encode()):
-                    wav = wav_files[stim.stim]
+                    scheduler.mark_onset()
                     sd.play_stereo(wav)
-                iti = np.random.uniform(1.5, 2.5)
-                result = await psi.monitor(iti)
+                    scheduler.mark_offset()
+                # Next onset is planned relative to the planned onset of this
+                # stim so that the ITI does not include any time lost to
+                # playback and polling. If this stim was late, the ITI is
+                # shortened to catch up, but never below the minimum ITI.
+                duration = wav.shape[-1] / sd.fs
+                durations.append(duration)
+                iti = np.random.uniform(min_iti, max_iti)
+                scheduler.schedule_next(duration + iti, duration + min_iti)
+                deadline = scheduler.next_onset - scheduler.spin_margin
+                result = await psi.monitor_until(deadline, scheduler.clock)
                 if len(result) != 1:
                     log.error('We failed to get the trigger for this stim')
                     result = {}
                 else:
                     result = result[0]
-                    result['iti'] = iti
                     config.experiment_info.score_stim(stim, result['is_correct'])
+                result['planned_iti'] = iti
                 results.append(result)
+            # Wait out the ITI of the final stim so that we have the achieved
+            # ITI for every trial.
+            await scheduler.finish()
         if incomplete_filename.exists():
             incomplete_filename.unlink()
     except Exception as exc:
@@ -123,6 +140,13 @@ async def nback(n_back, config, filename, exclude_targets=None):
             filename = incomplete_filename
         else:
             filename = complete_filename
+        if scheduler.planned:
+            timing = scheduler.get_timing()
+            for result, t, duration in zip(results, timing, durations):
+                result.update(t)
+                if 'interval' in t:
+                    result['iti'] = t['interval'] - duration
+            settings['timing'] = scheduler.report()
         settings['results'] = results
         with filename.with_suffix('.json').open('w') as fh:
             json.dump(settings, fh, cls=BiosemiEncoder, indent=2)
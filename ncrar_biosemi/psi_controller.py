@@ -1,6 +1,7 @@
 import asyncio
 import json
 import subprocess
+import time
 import websockets
 
 
@@ -41,12 +42,20 @@ class PSIController:
         )
         print('done sending')
 
-    async def monitor(self, timeout):
-        await asyncio.sleep(timeout)
+    async def monitor_until(self, deadline, clock=time.perf_counter):
+        '''
+        Collect results as they arrive until `deadline` on `clock`
+
+        Returns no later than the deadline so that the next trial can be
+        presented on time.
+        '''
         results = []
         while True:
+            remaining = deadline - clock()
+            if remaining <= 0:
+                break
             try:
-                result = await asyncio.wait_for(self.ws.recv(), 0.001)
+                result = await asyncio.wait_for(self.ws.recv(), remaining)
                 result = json.loads(result)
                 if result.get('event') == 'experiment_end':
                     print('Experiment ended')
@@ -0,0 +1,203 @@
+import logging
+log = logging.getLogger(__name__)
+
+import asyncio
+import time
+
+import numpy as np
+
+
+class TrialScheduler:
+    '''
+    Schedules trial onsets against absolute deadlines on a monotonic clock
+
+    Each deadline is planned relative to the previous *planned* onset rather
+    than to the time the previous trial actually finished, so lateness on one
+    trial is absorbed by the next interval instead of accumulating over the
+    block. The next onset is never planned sooner than `min_interval` after
+    the previous *actual* onset, so a late onset shortens the following
+    interval by at most `interval - min_interval`. Beyond that, the schedule
+    is effectively re-anchored to the actual onset. The planned interval saved
+    for each trial is the one actually used after this adjustment.
+
+    Typical use is::
+
+        scheduler.start(delay=1)
+        for trial in trials:
+            await scheduler.wait()
+            scheduler.mark_onset()
+            present(trial)
+            scheduler.mark_offset()
+            scheduler.schedule_next(interval, min_interval)
+        await scheduler.finish()
+
+    Parameters
+    ----------
+    spin_margin : float
+        Time (in sec) before each deadline at which we stop yielding to the
+        event loop and busy-wait on the clock instead. Sleeping in the event
+        loop can wake up to one timer tick late (about 15.6 msec on Windows),
+        so this should be larger than the timer tick.
+    max_lateness : float
+        Onsets later than this (in sec) are logged as a warning.
+    clock : callable
+        Monotonic clock returning time in sec.
+    '''
+
+    def __init__(self, spin_margin=0.02, max_lateness=0.01,
+                 clock=time.perf_counter):
+        self.spin_margin = spin_margin
+        self.max_lateness = max_lateness
+        self.clock = clock
+        self.t0 = None
+        self.next_onset = None
+        self.planned = []
+        self.actual = []
+        self.offsets = []
+        self.planned_intervals = []
+        self.planned_end = None
+        self.actual_end = None
+
+    def start(self, delay=0):
+        '''
+        Start the schedule with the first onset `delay` sec from now
+        '''
+        self.t0 = self.clock()
+        self.next_onset = self.t0 + delay
+        self.planned = []
+        self.actual = []
+        self.offsets = []
+        self.planned_intervals = []
+        self.planned_end = None
+        self.actual_end = None
+
+    def schedule_next(self, interval, min_interval=0):
+        '''
+        Plan the next onset `interval` sec after the most recent planned
+        onset, but no sooner than `min_interval` sec after the most recent
+        actual onset.
+        '''
+        planned, actual = self.planned[-1], self.actual[-1]
+        lateness = actual - planned
+        if lateness > self.max_lateness:
+            log.warning('Trial onset was %.1f msec late.', lateness * 1e3)
+        next_onset = planned + interval
+        earliest = actual + min_interval
+        if next_onset < earliest:
+            log.debug('Clamping interval to %.3f sec after actual onset.',
+                      min_interval)
+            next_onset = earliest
+            interval = min_interval
+        self.planned_intervals.append(interval)
+        self.next_onset = next_onset
+
+    def time_remaining(self):
+        return self.next_onset - self.clock()
+
+    async def wait(self):
+        '''
+        Wait until the next planned onset
+        '''
+        remaining = self.time_remaining() - self.spin_margin
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+        while self.clock() < self.next_onset:
+            pass
+
+    def mark_onset(self):
+        '''
+        Record the actual onset of the current trial
+
+        This should be called as close as possible to the start of stimulus
+        presentation (i.e., after the trigger is set and immediately before
+        playback) so that trigger latency is included in the onset error.
+        '''
+        actual = self.clock()
+        self.planned.append(self.next_onset)
+        self.actual.append(actual)
+        return actual
+
+    def mark_offset(self):
+        '''
+        Record the time at which presentation of the current trial returned
+        '''
+        offset = self.clock()
+        self.offsets.append(offset)
+        return offset
+
+    async def finish(self):
+        '''
+        Wait until the deadline following the final trial and record the end
+        of the schedule without recording an onset
+        '''
+        await self.wait()
+        self.planned_end = self.next_onset
+        self.actual_end = self.clock()
+
+    def _intervals(self):
+        actual = self.actual.copy()
+        if self.actual_end is not None:
+            actual.append(self.actual_end)
+        interval = np.diff(actual)
+        planned_interval = np.array(self.planned_intervals[:len(interval)])
+        return planned_interval, interval
+
+    def get_timing(self):
+        '''
+        Return planned and actual onsets (relative to start of schedule) for
+        each trial along with the onset error and achieved onset-to-onset
+        interval.
+        '''
+        planned = np.array(self.planned) - self.t0
+        actual = np.array(self.actual) - self.t0
+        offsets = np.array(self.offsets) - self.t0
+        error = actual - planned
+        planned_interval, interval = self._intervals()
+        timing = []
+        for i in range(len(planned)):
+            t = {
+                'planned_onset': planned[i],
+                'actual_onset': actual[i],
+                'onset_error': error[i],
+            }
+            if i < len(offsets):
+                t['offset'] = offsets[i]
+            if i < len(interval):
+                t['interval'] = interval[i]
+                t['planned_interval'] = planned_interval[i]
+            timing.append(t)
+        return timing
+
+    def get_jitter_stats(self):
+        '''
+        Summarize onset error and onset-to-onset interval error (in sec)
+        '''
+        error = np.array(self.actual) - np.array(self.planned)
+        planned_interval, interval = self._intervals()
+        interval_error = interval - planned_interval
+        stats = {'n_onsets': len(error)}
+        for name, x in (('onset_error', error),
+                        ('interval_error', interval_error)):
+            if len(x) == 0:
+                continue
+            stats[f'{name}_mean'] = x.mean()
+            stats[f'{name}_std'] = x.std()
+            stats[f'{name}_min'] = x.min()
+            stats[f'{name}_max'] = x.max()
+            stats[f'{name}_abs_max'] = np.abs(x).max()
+        return stats
+
+    def report(self):
+        stats = self.get_jitter_stats()
+        if 'onset_error_mean' not in stats:
+            return stats
+        m = 'Onset error over %d onsets: mean %.2f, SD %.2f, max %.2f msec.'
+        log.info(m, stats['n_onsets'], stats['onset_error_mean'] * 1e3,
+                 stats['onset_error_std'] * 1e3,
+                 stats['onset_error_abs_max'] * 1e3)
+        if 'interval_error_mean' in stats:
+            m = 'Interval error: mean %.2f, SD %.2f, max %.2f msec.'
+            log.info(m, stats['interval_error_mean'] * 1e3,
+                     stats['interval_error_std'] * 1e3,
+                     stats['interval_error_abs_max'] * 1e3)
+        return stats
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from ncrar_biosemi.scheduler import TrialScheduler
+
+
+class FakeClock:
+
+    def __init__(self, t=100.0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+def run_trials(scheduler, clock, latencies, intervals, min_interval=0):
+    '''
+    Presents one trial per entry in `latencies`, each starting the given
+    amount of time after its deadline.
+    '''
+    scheduler.start(delay=1)
+    for latency, interval in zip(latencies, intervals):
+        clock.t = scheduler.next_onset + latency
+        scheduler.mark_onset()
+        clock.t += 0.5
+        scheduler.mark_offset()
+        scheduler.schedule_next(interval, min_interval)
+    clock.t = scheduler.next_onset
+    asyncio.run(scheduler.finish())
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def scheduler(clock):
+    return TrialScheduler(clock=clock)
+
+
+def test_onsets_do_not_drift(scheduler, clock):
+    latencies = [0.003, 0.005, 0.002, 0.004]
+    run_trials(scheduler, clock, latencies, [2.0] * 4)
+    timing = scheduler.get_timing()
+    planned = [t['planned_onset'] for t in timing]
+    assert planned == pytest.approx([1, 3, 5, 7])
+    error = [t['onset_error'] for t in timing]
+    assert error == pytest.approx(latencies)
+    assert [t['offset'] for t in timing] == \
+        pytest.approx([p + l + 0.5 for p, l in zip(planned, latencies)])
+
+
+def test_min_interval_clamp(scheduler, clock, caplog):
+    caplog.set_level('DEBUG')
+    run_trials(scheduler, clock, [0.2, 0.0], [2.0, 2.0], min_interval=1.9)
+    timing = scheduler.get_timing()
+
+    # First trial was 200 msec late, so the next onset is clamped to 1.9 sec
+    # after the actual onset rather than 2.0 sec after the planned onset.
+    assert timing[0]['planned_interval'] == pytest.approx(1.9)
+    assert timing[0]['interval'] == pytest.approx(1.9)
+    assert timing[1]['planned_onset'] == pytest.approx(1 + 0.2 + 1.9)
+    assert timing[1]['planned_interval'] == pytest.approx(2.0)
+    assert timing[1]['interval'] == pytest.approx(2.0)
+
+    warnings = [r for r in caplog.records if r.levelname == 'WARNING']
+    assert len(warnings) == 1
+
+
+def test_small_lateness_does_not_warn(scheduler, clock, caplog):
+    # ITI drawn close to the minimum means the clamp is applied even for
+    # ordinary msec lateness. This should not be reported as a warning.
+    run_trials(scheduler, clock, [0.0032, 0.0], [2.0, 2.0], min_interval=1.999)
+    warnings = [r for r in caplog.records if r.levelname == 'WARNING']
+    assert len(warnings) == 0
+    timing = scheduler.get_timing()
+    assert timing[0]['planned_interval'] == pytest.approx(1.999)
+
+
+def test_jitter_stats(scheduler, clock):
+    latencies = [0.001, 0.003, 0.002]
+    run_trials(scheduler, clock, latencies, [2.0] * 3)
+    stats = scheduler.get_jitter_stats()
+
+    # The end of the schedule is not an onset.
+    assert stats['n_onsets'] == 3
+    assert stats['onset_error_mean'] == pytest.approx(0.002)
+    assert stats['onset_error_min'] == pytest.approx(0.001)
+    assert stats['onset_error_max'] == pytest.approx(0.003)
+
+    # The final interval runs to the end of the schedule, which was on time.
+    timing = scheduler.get_timing()
+    interval_error = [t['interval'] - t['planned_interval'] for t in timing]
+    assert interval_error == pytest.approx([0.002, -0.001, -0.002])
+    assert stats['interval_error_abs_max'] == pytest.approx(0.002)
+    assert stats['interval_error_mean'] == pytest.approx(-0.001 / 3)